@@ -3,14 +3,25 @@
 Extractor de expenses de la API de Fudo con soporte para logging de IDs extraídos.
 """
 
-import json
+import hashlib
 import os
+import orjson
+import re
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from itertools import filterfalse
+from pathlib import Path
+from types import MappingProxyType
+from urllib.parse import urlencode
+from typing import List, Dict, Optional, Tuple, Union
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from utils.gcp import get_secret
 from utils.logger import get_logger
+from utils.throttling import AdaptiveConcurrency, RateLimiter
 
 logger = get_logger(__name__)
 
@@ -18,17 +29,130 @@ FUDO_AUTH_URL = "https://auth.fu.do/api"
 FUDO_API_URL = "https://api.fu.do/v1alpha1"
 EXTRACTION_DATA_DIR = "raw"
 EXTRACTED_LOG_FILE = "logs/extracted_expenses_log.txt"
+GCS_LOG_PATH = "logs/extracted_expenses_log.txt"
+RAW_FILE_PATTERN = re.compile(r"^expense_(\d+)\.json$")
+LOG_ID_PATTERN = re.compile(rb"^[ \t]*(\d+)[ \t\r]*$", re.MULTILINE)
+MAX_WORKERS = 16
+REQUEST_TIMEOUT = 30
+# Rangos menores a este tamaño se escanean directamente sin sondeo previo
+MIN_PROBE_RANGE = 64
+# Cantidad de IDs consecutivos consultados por sondeo, para tolerar huecos (expenses borrados)
+PROBE_WINDOW = 3
+# Cada cuántos IDs nuevos se sube el log completo a GCS
+LOG_FLUSH_EVERY = 100
+UPLOAD_WORKERS = 8
+# Vigencia asumida del token si la API no informa su expiración, y margen de renovación anticipada
+TOKEN_TTL_SECONDS = 3600
+TOKEN_EXPIRY_MARGIN = 60
+# Token persistido entre ejecuciones, un archivo por credencial (hash de URL de auth + API key);
+# solo se reutiliza si le quedan al menos TOKEN_CACHE_MIN_TTL segundos
+TOKEN_CACHE_DIR = Path.home() / ".cache"
+TOKEN_CACHE_MIN_TTL = 300
+# Latencia media por encima de la cual se reduce la concurrencia hacia la API
+TARGET_LATENCY_SECONDS = 1.5
+# Objetivo propio para las peticiones en bloque, que traen hasta BULK_FETCH_SIZE expenses
+BULK_TARGET_LATENCY_SECONDS = 6.0
+# Errores seguidos que abren el circuito, y segundos de pausa antes de reintentar
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_COOLDOWN = 30
+# Cupo restante de la API (absoluto o fracción del límite) por debajo del cual se espera al reinicio
+RATE_LIMIT_MIN_REMAINING = 2
+RATE_LIMIT_MIN_FRACTION = 0.1
+
+# Campos del JSON crudo que se publica en raw/ (contrato con GCS: no recortar atributos);
+# inmutable porque se comparte entre hilos
+EXPENSE_PARAMS = MappingProxyType({
+    "fields[expense]": "amount,canceled,cashRegister,createdAt,date,description,dueDate,expenseCategory,expenseItems,paymentDate,paymentMethod,provider,receiptNumber,receiptType,useInCashCount,user",
+    "fields[cashRegister]": "name",
+    "fields[expenseCategory]": "name", 
+    "fields[paymentMethod]": "code,name",
+    "fields[provider]": "name",
+    "fields[receiptType]": "name",
+    "fields[product]": "cost,unit,name",
+    "fields[ingredient]": "cost,unit,name",
+    "fields[expenseItem]": "canceled,detail,price,product,ingredient,quantity",
+    "fields[user]": "name",
+    "include": "expenseItems,expenseItems.product,expenseItems.ingredient,cashRegister,expenseCategory,paymentMethod,provider,receiptType,user"
+})
+
+# Query string ya codificado una vez: cada GET solo concatena el ID a la URL
+EXPENSE_QUERY = urlencode(EXPENSE_PARAMS)
+
+# Máximo de IDs por petición en bloque (acotado por el largo de la URL)
+BULK_FETCH_SIZE = 50
+
+# Respuesta mínima para sondear existencia cuando HEAD no está disponible
+PROBE_PARAMS = MappingProxyType({"fields[expense]": "canceled"})
 
 class ExpenseExtractor:
     """Clase para extraer expenses de la API de Fudo."""
     
     def __init__(self):
         self.token = None
-        os.makedirs(EXTRACTION_DATA_DIR, exist_ok=True)
-        os.makedirs("logs", exist_ok=True)
+        self._token_expiry = 0.0
+        self._auth_headers = {}
+        self._token_lock = threading.Lock()
+        self._head_supported = True
+        self._bulk_supported = True
+        # IDs extraídos ya parseados del log; None obliga a releer el archivo
+        self._extracted_ids = None
+        # IDs registrados localmente que aún no se subieron a GCS
+        self._unflushed_log_ids = 0
+        # Handle del log abierto en modo append; se abre al primer registro
+        self._log_fh = None
+        # Subidas de JSON a GCS en segundo plano
+        self._upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+        self._pending_uploads = []
+        self.session = self._create_session()
+        from utils.env_config import config
+        self.rate_limiter = RateLimiter(config.EXPENSE_RPS)
+        self.concurrency = AdaptiveConcurrency(
+            max_limit=MAX_WORKERS,
+            target_latency=TARGET_LATENCY_SECONDS,
+            failure_threshold=CIRCUIT_BREAKER_THRESHOLD,
+            cooldown=CIRCUIT_BREAKER_COOLDOWN
+        )
+        self.raw_dir = Path(EXTRACTION_DATA_DIR)
+        self.raw_dir.mkdir(parents=True, exist_ok=True)
+        Path(EXTRACTED_LOG_FILE).parent.mkdir(parents=True, exist_ok=True)
         # Descargar el log desde GCS al inicializar el extractor
         self._download_log_from_gcs()
     
+    def close(self):
+        """Completa las subidas pendientes a GCS y libera las conexiones HTTP abiertas por la sesión."""
+        self.wait_for_uploads()
+        self._upload_pool.shutdown()
+        self.flush_log()
+        self._close_log_handle()
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    @staticmethod
+    def _create_session() -> requests.Session:
+        """Crea una sesión HTTP con pool de conexiones y reintentos para errores transitorios."""
+        # El ritmo lo marca la propia API: solo se espera ante 429/5xx, respetando Retry-After.
+        # Agotados los reintentos se devuelve la última respuesta en vez de lanzar RetryError,
+        # para que _handle_rate_limit_headers pause a todos los hilos con su Retry-After
+        retry = Retry(
+            total=10,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET", "HEAD"],
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=retry)
+        session = requests.Session()
+        session.headers.update({"Connection": "keep-alive"})
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+    
     def _download_log_from_gcs(self):
         """Descarga el archivo de log desde Google Cloud Storage si existe."""
         from utils.gcp import download_file_from_gcs
@@ -39,15 +163,14 @@ class ExpenseExtractor:
                 logger.warning("GCS_BUCKET_NAME no configurado, omitiendo descarga del log desde GCS")
                 return
                 
-            gcs_log_path = "logs/extracted_expenses_log.txt"
             success = download_file_from_gcs(
                 bucket_name=config.GCS_BUCKET_NAME,
-                gcs_file_path=gcs_log_path,
+                gcs_file_path=GCS_LOG_PATH,
                 local_file_path=EXTRACTED_LOG_FILE
             )
             
             if success:
-                logger.info(f"📥 Archivo de log descargado desde GCS: {gcs_log_path}")
+                logger.info(f"📥 Archivo de log descargado desde GCS: {GCS_LOG_PATH}")
             else:
                 logger.info(f"📄 No se encontró archivo de log en GCS, iniciando con log vacío")
                 
@@ -55,22 +178,39 @@ class ExpenseExtractor:
             logger.warning(f"Error descargando log desde GCS: {e}")
             # Continuar sin fallar si GCS no está disponible
     
+    def _close_log_handle(self):
+        """Cierra el handle del log; necesario antes de reescribir el archivo completo."""
+        if self._log_fh is not None:
+            self._log_fh.close()
+            self._log_fh = None
+    
     def get_extracted_ids(self) -> set:
-        """Obtiene la lista de IDs ya extraídos desde GCS o archivo de log local."""
+        """
+        Obtiene la lista de IDs ya extraídos desde GCS o archivo de log local.
+        
+        El log solo se parsea de nuevo si GCS trajo una versión más reciente; el
+        set devuelto es el mismo que mantiene el extractor y no debe modificarse.
+        """
         try:
             # Primero intentar descargar desde GCS
             if self._sync_log_from_gcs():
                 logger.debug("📥 Log sincronizado desde GCS")
             
-            # Leer archivo local (ya sea descargado de GCS o existente)
-            if os.path.exists(EXTRACTED_LOG_FILE):
-                with open(EXTRACTED_LOG_FILE, 'r') as f:
-                    return {int(line.strip()) for line in f if line.strip().isdigit()}
-            return set()
+            if self._extracted_ids is None:
+                self._extracted_ids = self._read_log_ids()
+            return self._extracted_ids
         except Exception as e:
             logger.warning(f"Error leyendo archivo de log: {e}")
             return set()
     
+    def _read_log_ids(self) -> set:
+        """Lee el archivo de log local (ya sea descargado de GCS o existente)."""
+        if not os.path.exists(EXTRACTED_LOG_FILE):
+            return set()
+        # Lectura binaria de una vez y extracción con regex compilada, sin decodificar línea a línea
+        with open(EXTRACTED_LOG_FILE, 'rb') as f:
+            return set(map(int, LOG_ID_PATTERN.findall(f.read())))
+    
     def _sync_log_from_gcs(self) -> bool:
         """Descarga el log desde GCS si existe y es más reciente."""
         from utils.gcp import get_storage_client
@@ -83,8 +223,7 @@ class ExpenseExtractor:
                 return False
             
             bucket = client.bucket(config.GCS_BUCKET_NAME)
-            gcs_log_path = "logs/extracted_expenses_log.txt"
-            blob = bucket.blob(gcs_log_path)
+            blob = bucket.blob(GCS_LOG_PATH)
             
             # Verificar si el blob existe
             if not blob.exists():
@@ -102,8 +241,10 @@ class ExpenseExtractor:
                     return False
             
             # Descargar desde GCS
+            self._close_log_handle()
             blob.download_to_filename(EXTRACTED_LOG_FILE)
-            logger.info(f"📥 Log descargado desde GCS: {gcs_log_path}")
+            self._extracted_ids = None
+            logger.info(f"📥 Log descargado desde GCS: {GCS_LOG_PATH}")
             return True
             
         except Exception as e:
@@ -111,18 +252,42 @@ class ExpenseExtractor:
             return False
     
     def log_extracted_id(self, expense_id: int):
-        """Registra un ID como extraído en el archivo de log local y en GCS."""
+        """
+        Registra un ID como extraído en el archivo de log local.
+        
+        El log se sube a GCS cada LOG_FLUSH_EVERY IDs en lugar de tras cada uno;
+        flush_log() sube lo pendiente al terminar.
+        """
         try:
-            # Guardar localmente
-            with open(EXTRACTED_LOG_FILE, 'a') as f:
-                f.write(f"{expense_id}\n")
+            # Guardar localmente (line-buffered: cada ID llega al archivo sin reabrirlo)
+            if self._log_fh is None:
+                self._log_fh = open(EXTRACTED_LOG_FILE, 'a', buffering=1)
+            self._log_fh.write(f"{expense_id}\n")
+            if self._extracted_ids is not None:
+                self._extracted_ids.add(expense_id)
             
-            # Subir a GCS
-            self._upload_log_to_gcs()
+            self._unflushed_log_ids += 1
+            if self._unflushed_log_ids >= LOG_FLUSH_EVERY:
+                self.flush_log()
                 
         except Exception as e:
             logger.error(f"Error escribiendo en el log: {e}")
     
+    def flush_log(self):
+        """
+        Sube el log a GCS si hay IDs registrados desde la última subida.
+        
+        Antes espera las subidas de JSON en curso: el log en GCS no debe marcar
+        como extraído un ID cuyo archivo crudo todavía no llegó al bucket.
+        """
+        if not self._unflushed_log_ids:
+            return
+        self.wait_for_uploads()
+        if self._log_fh is not None:
+            os.fsync(self._log_fh.fileno())
+        if self._upload_log_to_gcs():
+            self._unflushed_log_ids = 0
+    
     def _upload_log_to_gcs(self):
         """Sube el archivo de log a GCS."""
         from utils.gcp import get_storage_client
@@ -135,13 +300,12 @@ class ExpenseExtractor:
                 return False
             
             bucket = client.bucket(config.GCS_BUCKET_NAME)
-            gcs_log_path = "logs/extracted_expenses_log.txt"
-            blob = bucket.blob(gcs_log_path)
+            blob = bucket.blob(GCS_LOG_PATH)
             
             with open(EXTRACTED_LOG_FILE, 'rb') as f:
                 blob.upload_from_file(f, content_type='text/plain')
             
-            logger.debug(f"🌩️  Log actualizado en GCS: {gcs_log_path}")
+            logger.debug(f"🌩️  Log actualizado en GCS: {GCS_LOG_PATH}")
             return True
             
         except Exception as gcs_error:
@@ -151,8 +315,9 @@ class ExpenseExtractor:
     def filter_unextracted_ids(self, start_id: int, end_id: int) -> List[int]:
         """Filtra los IDs que aún no han sido extraídos."""
         extracted_ids = self.get_extracted_ids()
-        all_ids = list(range(start_id, end_id + 1))
-        unextracted_ids = [id for id in all_ids if id not in extracted_ids]
+        all_ids = range(start_id, end_id + 1)
+        # filterfalse + __contains__ recorre el rango en C, sin materializar la lista completa
+        unextracted_ids = list(filterfalse(extracted_ids.__contains__, all_ids))
         
         if len(unextracted_ids) != len(all_ids):
             skipped_count = len(all_ids) - len(unextracted_ids)
@@ -176,144 +341,486 @@ class ExpenseExtractor:
             logger.info("📋 Archivo de log ya existe, no es necesario inicializar")
             return
         
-        existing_files = []
+        # Extraer ID del nombre del archivo (expense_123.json -> 123)
+        existing_ids = []
         if os.path.exists(EXTRACTION_DATA_DIR):
-            existing_files = [f for f in os.listdir(EXTRACTION_DATA_DIR) if f.startswith('expense_') and f.endswith('.json')]
+            with os.scandir(EXTRACTION_DATA_DIR) as entries:
+                existing_ids = [int(m.group(1)) for entry in entries if (m := RAW_FILE_PATTERN.match(entry.name))]
         
-        if not existing_files:
+        if not existing_ids:
             logger.info("📋 No hay archivos existentes, log inicializado vacío")
             # Crear archivo vacío y subirlo a GCS
             with open(EXTRACTED_LOG_FILE, 'w') as f:
                 pass  # Archivo vacío
+            self._extracted_ids = set()
             self._upload_log_to_gcs()
             return
         
-        existing_ids = []
-        for filename in existing_files:
-            try:
-                # Extraer ID del nombre del archivo (expense_123.json -> 123)
-                expense_id = int(filename.replace('expense_', '').replace('.json', ''))
-                existing_ids.append(expense_id)
-            except ValueError:
-                continue
-        
         existing_ids.sort()
         
         with open(EXTRACTED_LOG_FILE, 'w') as f:
-            for expense_id in existing_ids:
-                f.write(f"{expense_id}\n")
+            f.write("\n".join(map(str, existing_ids)) + "\n")
+        self._extracted_ids = set(existing_ids)
         
         # Subir a GCS
         self._upload_log_to_gcs()
         
         logger.info(f"📋 Log inicializado con {len(existing_ids)} IDs existentes: {min(existing_ids)}-{max(existing_ids)} y sincronizado con GCS")
     
-    def get_token(self) -> str:
-        """Obtiene el token de autenticación desde la API de Fudo."""
+    def get_token(self, use_cache: bool = False) -> str:
+        """
+        Obtiene el token de autenticación desde la API de Fudo.
+        
+        Con use_cache=True reutiliza el token guardado en disco por una ejecución
+        anterior con la misma API key mientras siga vigente, evitando el login.
+        """
         try:
+            # La API key basta para identificar la caché; el secreto solo se lee si hay que hacer login
             api_key = get_secret("fudo-api-key")
-            api_secret = get_secret("fudo-api-secret")
+            cache_key = self._token_cache_key(api_key)
+
+            if use_cache and self._load_cached_token(cache_key):
+                logger.info("Token reutilizado desde caché local.")
+                return self.token
 
+            api_secret = get_secret("fudo-api-secret")
             payload = {"apiKey": api_key, "apiSecret": api_secret}
             headers = {"Content-Type": "application/json"}
 
-            response = requests.post(FUDO_AUTH_URL, json=payload, headers=headers)
+            response = self.session.post(FUDO_AUTH_URL, json=payload, headers=headers, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
 
-            token = response.json().get("token")
+            data = response.json()
+            token = data.get("token")
             if not token:
                 raise Exception("Token no encontrado en la respuesta.")
 
+            # 'exp' es un timestamp unix; si no viene se asume la vigencia por defecto
+            exp = data.get("exp")
+            expires_at = exp if isinstance(exp, (int, float)) else time.time() + TOKEN_TTL_SECONDS
+
             logger.info("Token obtenido correctamente desde Fudo.")
-            self.token = token
+            self._set_token(token, expires_at)
+            self._save_cached_token(cache_key, token, expires_at)
             return token
 
         except Exception as e:
             logger.error(f"Error al obtener token: {e}")
             raise
     
+    def _set_token(self, token: str, expires_at: float):
+        """Activa un token; expires_at es un timestamp unix."""
+        self.token = token
+        self._token_expiry = time.monotonic() + (expires_at - time.time()) - TOKEN_EXPIRY_MARGIN
+        self._auth_headers = {"Authorization": f"Bearer {token}"}
+    
+    @staticmethod
+    def _token_cache_key(api_key: str) -> str:
+        """Identifica la credencial (y el ambiente) dueña de un token sin guardar la API key en disco."""
+        return hashlib.sha256(f"{FUDO_AUTH_URL}\n{api_key}".encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _token_cache_path(cache_key: str) -> Path:
+        """Archivo de caché del token para una credencial."""
+        return TOKEN_CACHE_DIR / f"fudo_token_{cache_key[:16]}.json"
+    
+    def _load_cached_token(self, cache_key: str) -> bool:
+        """Carga el token guardado en disco si es de esta credencial y aún le queda vigencia suficiente."""
+        try:
+            cached = orjson.loads(self._token_cache_path(cache_key).read_bytes())
+            if cached.get("key") != cache_key:
+                logger.debug("Token en caché de otra credencial, se ignora")
+                return False
+            if cached["expires_at"] - time.time() < TOKEN_CACHE_MIN_TTL:
+                return False
+            self._set_token(cached["token"], cached["expires_at"])
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.debug(f"Caché de token ilegible, se ignora: {e}")
+            return False
+    
+    def _save_cached_token(self, cache_key: str, token: str, expires_at: float):
+        """Guarda el token en disco de forma atómica y legible solo por el usuario actual."""
+        try:
+            cache_path = self._token_cache_path(cache_key)
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(".tmp")
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(orjson.dumps({"key": cache_key, "token": token, "expires_at": expires_at}))
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar el token en caché: {e}")
+    
+    def _ensure_token(self):
+        """Obtiene un token si no hay uno o si el actual está por expirar."""
+        token = self.token
+        if not token or time.monotonic() >= self._token_expiry:
+            self._refresh_token(token)
+    
+    def _refresh_token(self, expired_token: Optional[str]):
+        """Renueva el token una sola vez aunque varios hilos detecten el 401 a la vez."""
+        with self._token_lock:
+            if self.token == expired_token:
+                self.token = None
+                # La caché en disco solo sirve para el primer token; si uno falló o venció se pide otro
+                self.get_token(use_cache=expired_token is None)
+    
     def get_expense_by_id(self, expense_id: int) -> Optional[Dict]:
         """Obtiene un expense específico por ID con todos los campos disponibles."""
+        content = self.get_expense_content_by_id(expense_id)
+        return orjson.loads(content) if content else None
+    
+    def _api_get(self, url: str, target_latency: Optional[float] = None) -> requests.Response:
+        """GET a la API respetando el límite de ritmo y la concurrencia adaptativa."""
+        return self._api_request("GET", url, target_latency=target_latency)
+    
+    def _api_request(self, method: str, url: str, params: Optional[Dict] = None,
+                     target_latency: Optional[float] = None) -> requests.Response:
+        """Petición a la API respetando el límite de ritmo y la concurrencia adaptativa."""
+        self.concurrency.acquire()
+        self.rate_limiter.acquire()
+        start = time.perf_counter()
         try:
-            if not self.token:
-                self.get_token()
-                
-            headers = {"Authorization": f"Bearer {self.token}"}
-            url = f"{FUDO_API_URL}/expenses/{expense_id}"
-            
-            params = {
-                "fields[expense]": "amount,canceled,cashRegister,createdAt,date,description,dueDate,expenseCategory,expenseItems,paymentDate,paymentMethod,provider,receiptNumber,receiptType,useInCashCount,user",
-                "fields[cashRegister]": "name",
-                "fields[expenseCategory]": "name", 
-                "fields[paymentMethod]": "code,name",
-                "fields[provider]": "name",
-                "fields[receiptType]": "name",
-                "fields[product]": "cost,unit,name",
-                "fields[ingredient]": "cost,unit,name",
-                "fields[expenseItem]": "canceled,detail,price,product,ingredient,quantity",
-                "fields[user]": "name",
-                "include": "expenseItems,expenseItems.product,expenseItems.ingredient,cashRegister,expenseCategory,paymentMethod,provider,receiptType,user"
-            }
+            response = self.session.request(method, url, headers=self._auth_headers, params=params, timeout=REQUEST_TIMEOUT)
+        except Exception:
+            self.concurrency.release(time.perf_counter() - start, success=False)
+            raise
+        
+        # La latencia incluye los reintentos de urllib3, así que un 429 absorbido también reduce la concurrencia
+        throttled = response.status_code == 429 or response.status_code >= 500
+        self.concurrency.release(time.perf_counter() - start, success=not throttled, target_latency=target_latency)
+        self._handle_rate_limit_headers(response)
+        return response
+    
+    def _handle_rate_limit_headers(self, response: requests.Response):
+        """Pausa los envíos antes de agotar la cuota si la API informa sus límites."""
+        headers = response.headers
+        try:
+            retry_after = headers.get("Retry-After")
+            if response.status_code == 429 and retry_after:
+                self.rate_limiter.defer(float(retry_after))
+                return
             
-            response = requests.get(url, headers=headers, params=params)
+            remaining = headers.get("X-RateLimit-Remaining")
+            reset = headers.get("X-RateLimit-Reset")
+            if remaining is None or reset is None:
+                return
+            
+            remaining = int(remaining)
+            limit = headers.get("X-RateLimit-Limit")
+            near_limit = remaining <= RATE_LIMIT_MIN_REMAINING or (limit and remaining / int(limit) < RATE_LIMIT_MIN_FRACTION)
+            if near_limit:
+                # El reset puede venir como timestamp unix o como segundos restantes
+                reset = float(reset)
+                wait_seconds = reset - time.time() if reset > 1e9 else reset
+                if wait_seconds > 0:
+                    logger.info(f"⏳ Quedan {remaining} peticiones en la cuota de la API, pausando {wait_seconds:.1f}s")
+                    self.rate_limiter.defer(wait_seconds)
+        except (ValueError, ZeroDivisionError):
+            logger.debug("Cabeceras de rate limit con formato inesperado, se ignoran")
+    
+    def get_expense_content_by_id(self, expense_id: int) -> Optional[bytes]:
+        """Obtiene el cuerpo JSON crudo de un expense, sin parsearlo."""
+        try:
+            self._ensure_token()
+            
+            token = self.token
+            url = f"{FUDO_API_URL}/expenses/{expense_id}?{EXPENSE_QUERY}"
+            
+            response = self._api_get(url)
             
             if response.status_code == 404:
                 logger.info(f"Expense {expense_id} no encontrado (404)")
                 return None
             elif response.status_code == 401:
                 logger.warning("Token expirado, renovando...")
-                self.token = None
-                self.get_token()
-                headers = {"Authorization": f"Bearer {self.token}"}
-                response = requests.get(url, headers=headers, params=params)
+                self._refresh_token(token)
+                response = self._api_get(url)
             
             response.raise_for_status()
             
             logger.info(f"Expense {expense_id} extraído correctamente")
-            return response.json()
+            return response.content
             
         except Exception as e:
             logger.error(f"Error al obtener expense {expense_id}: {e}")
             return None
 
-    def save_individual_expense(self, expense_data: Dict, expense_id: int) -> str:
-        """Guarda un expense individual en un archivo JSON localmente y en GCS."""
-        from utils.gcp import get_storage_client
-        from utils.env_config import config
+    def _fetch_ids(self, expense_ids: List[int]) -> List[Tuple[int, bytes]]:
+        """
+        Descarga un grupo de expenses y retorna pares (id, JSON crudo) de los encontrados.
         
+        Usa una sola petición en bloque cuando es posible. La respuesta en bloque solo
+        vale para los IDs que trae: los que faltan se piden de a uno, y si alguno
+        aparece así, el filtro no es confiable y se desactiva el modo en bloque.
+        """
+        results = {}
+        bulk = len(expense_ids) > 1 and self._bulk_supported
+        if bulk:
+            results = self._fetch_expenses_bulk(expense_ids)
+        
+        missing = [expense_id for expense_id in expense_ids if expense_id not in results]
+        for expense_id in missing:
+            content = self.get_expense_content_by_id(expense_id)
+            if content:
+                results[expense_id] = content
+                if bulk and self._bulk_supported:
+                    logger.warning(f"Expense {expense_id} no vino en la respuesta en bloque, extrayendo de a un ID")
+                    self._bulk_supported = False
+        
+        return list(results.items())
+    
+    def _fetch_expenses_bulk(self, expense_ids: List[int]) -> Dict[int, bytes]:
+        """
+        Pide varios expenses con filter[id] y separa la respuesta en un documento por expense.
+        
+        Returns:
+            JSON crudo por ID de los expenses que trajo la respuesta. Si la API rechaza
+            o ignora el filtro, se desactiva el modo en bloque para el resto de la ejecución.
+        """
+        try:
+            self._ensure_token()
+            token = self.token
+            bulk_params = {
+                "filter[id]": ",".join(map(str, expense_ids)),
+                "page[size]": len(expense_ids)
+            }
+            url = f"{FUDO_API_URL}/expenses?{EXPENSE_QUERY}&{urlencode(bulk_params)}"
+            
+            response = self._api_get(url, target_latency=BULK_TARGET_LATENCY_SECONDS)
+            if response.status_code == 401:
+                self._refresh_token(token)
+                response = self._api_get(url, target_latency=BULK_TARGET_LATENCY_SECONDS)
+            
+            if response.status_code in (400, 414, 422):
+                logger.info(f"La API no admite la petición en bloque ({response.status_code}), extrayendo de a un ID")
+                self._bulk_supported = False
+                return {}
+            response.raise_for_status()
+            
+            results = self._split_bulk_response(response.content)
+            
+            # Si vienen IDs no pedidos, la API ignoró el filtro
+            if not results.keys() <= set(expense_ids):
+                logger.info("La API ignora filter[id], extrayendo de a un ID")
+                self._bulk_supported = False
+                return {}
+            
+            logger.info(f"{len(results)} expenses extraídos en bloque ({expense_ids[0]}-{expense_ids[-1]})")
+            return results
+            
+        except Exception as e:
+            logger.error(f"Error en petición en bloque {expense_ids[0]}-{expense_ids[-1]}: {e}")
+            return {}
+    
+    @staticmethod
+    def _split_bulk_response(content: bytes) -> Dict[int, bytes]:
+        """Arma para cada expense el mismo documento {data, included} que retorna la consulta por ID."""
+        body = orjson.loads(content)
+        included_index = {(item.get("type"), item.get("id")): item for item in body.get("included") or []}
+        documents = {}
+        
+        for expense in body.get("data") or []:
+            related = []
+            seen = set()
+            pending = [expense]
+            # Recorrer relaciones transitivas: expense -> expenseItems -> product/ingredient -> ...
+            while pending:
+                node = pending.pop()
+                for relationship in (node.get("relationships") or {}).values():
+                    refs = relationship.get("data") if isinstance(relationship, dict) else None
+                    if isinstance(refs, dict):
+                        refs = [refs]
+                    for ref in refs or []:
+                        key = (ref.get("type"), ref.get("id"))
+                        if key in seen or key not in included_index:
+                            continue
+                        seen.add(key)
+                        related.append(included_index[key])
+                        pending.append(included_index[key])
+            
+            documents[int(expense["id"])] = orjson.dumps({"data": expense, "included": related})
+        
+        return documents
+    
+    def _expense_exists(self, expense_id: int) -> bool:
+        """
+        Verifica si un expense existe sin descargar el payload completo.
+        
+        Usa HEAD (sin cuerpo); si la API no lo admite, recurre a un GET con un
+        solo atributo y sin relaciones incluidas.
+        """
+        token = self.token
+        response = self._probe_request(expense_id)
+        
+        if response.status_code == 401:
+            self._refresh_token(token)
+            response = self._probe_request(expense_id)
+        
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+    
+    def _probe_request(self, expense_id: int) -> requests.Response:
+        """Ejecuta la petición de sondeo más barata disponible para un ID."""
+        url = f"{FUDO_API_URL}/expenses/{expense_id}"
+        if self._head_supported:
+            response = self._api_request("HEAD", url)
+            if response.status_code not in (405, 501):
+                return response
+            logger.info("La API no admite HEAD, sondeando con GET mínimo")
+            self._head_supported = False
+        return self._api_request("GET", url, params=PROBE_PARAMS)
+    
+    def _find_max_id(self, start_id: int, end_id: int) -> int:
+        """
+        Busca el último ID existente en el rango con sondeo exponencial y búsqueda binaria.
+        
+        Cada sondeo consulta PROBE_WINDOW IDs consecutivos para no confundir un
+        expense borrado con el final de los datos. Cada corte se verifica sondeando
+        exponencialmente hasta end_id; si aparece un expense, el corte era un hueco
+        y la búsqueda continúa desde él.
+        
+        Returns:
+            Último ID a escanear (end_id si no se pudo confirmar ningún corte)
+        """
+        search_from = start_id
+        while True:
+            last_id = self._search_boundary(search_from, end_id)
+            if last_id >= end_id:
+                return end_id
+            
+            found = self._find_present_after(last_id, end_id)
+            if found is None:
+                # Sin ningún expense confirmado en el rango no se recorta: se escanea completo
+                return last_id if last_id >= start_id else end_id
+            search_from = found
+    
+    def _find_present_after(self, after_id: int, end_id: int) -> Optional[int]:
+        """Sondea ventanas a distancias 1, 2, 4, ... de after_id y la última del rango; retorna el primer ID existente."""
+        probes = []
+        offset = 1
+        while after_id + offset <= end_id:
+            probes.append(after_id + offset)
+            offset *= 2
+        last_window = max(after_id + 1, end_id - PROBE_WINDOW + 1)
+        if not probes or probes[-1] + PROBE_WINDOW <= last_window:
+            probes.append(last_window)
+        
+        for probe in probes:
+            window_end = min(probe + PROBE_WINDOW, end_id + 1)
+            found = next((i for i in range(probe, window_end) if self._expense_exists(i)), None)
+            if found is not None:
+                return found
+        return None
+    
+    def _search_boundary(self, start_id: int, end_id: int) -> int:
+        """Sondeo exponencial y búsqueda binaria del primer hueco de PROBE_WINDOW IDs desde start_id."""
+        def present(expense_id: int) -> bool:
+            window_end = min(expense_id + PROBE_WINDOW, end_id + 1)
+            return any(self._expense_exists(i) for i in range(expense_id, window_end))
+        
+        # Fase exponencial: duplicar el salto hasta encontrar un ID ausente
+        lo, hi = start_id - 1, None
+        step = 1
+        while hi is None:
+            probe = min(lo + step, end_id)
+            if present(probe):
+                if probe == end_id:
+                    return end_id
+                lo = probe
+                step *= 2
+            else:
+                hi = probe
+        
+        # Fase binaria entre el último presente y el primer ausente
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if present(mid):
+                lo = mid
+            else:
+                hi = mid
+        
+        if lo < start_id:
+            return start_id - 1
+        return min(lo + PROBE_WINDOW - 1, end_id)
+    
+    def _clamp_end_id(self, start_id: int, end_id: int) -> int:
+        """Recorta end_id al último expense existente para no pagar GETs completos en la cola de 404."""
+        if end_id - start_id + 1 < MIN_PROBE_RANGE:
+            return end_id
+        
+        try:
+            self._ensure_token()
+            max_id = self._find_max_id(start_id, end_id)
+        except Exception as e:
+            logger.warning(f"Error sondeando el rango {start_id}-{end_id}, se escanea completo: {e}")
+            return end_id
+        
+        if max_id < end_id:
+            logger.warning(f"🔎 Sondeo sin expenses después de {max_id}, se omiten los IDs {max_id + 1}-{end_id} ({end_id - max_id} IDs)")
+        return max_id
+
+    def save_individual_expense(self, expense_data: Union[Dict, bytes], expense_id: int) -> str:
+        """
+        Guarda un expense individual en un archivo JSON localmente y en GCS.
+        
+        Acepta el dict ya parseado o los bytes crudos de la respuesta; estos
+        últimos se escriben tal cual, sin volver a serializar. La subida a GCS
+        se encola en segundo plano; wait_for_uploads() espera a que termine.
+        """
         try:
             filename = f"expense_{expense_id}.json"
-            filepath = os.path.join(EXTRACTION_DATA_DIR, filename)
+            filepath = self.raw_dir / filename
             
-            # Guardar localmente
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(expense_data, f, ensure_ascii=False, indent=2)
+            # Guardar localmente, en JSON compacto: sin indentación el archivo (y la subida a GCS) pesa aprox. la mitad
+            payload = expense_data if isinstance(expense_data, bytes) else orjson.dumps(expense_data)
+            # Escritura atómica: un corte a mitad de escritura no deja un JSON truncado en raw/
+            tmp_path = filepath.with_name(filename + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, filepath)
             
             logger.info(f"Expense individual guardado localmente: {filepath}")
             
-            # Subir a GCS
-            try:
-                client = get_storage_client()
-                if client:
-                    bucket = client.bucket(config.GCS_BUCKET_NAME)
-                    gcs_path = f"raw/fact_expenses/{filename}"  # Cambiado para incluir fact_expenses
-                    blob = bucket.blob(gcs_path)
-                    
-                    with open(filepath, 'rb') as f:
-                        blob.upload_from_file(f, content_type='application/json')
-                    
-                    logger.info(f"🌩️  Subido JSON a GCS: {gcs_path}")
-                else:
-                    logger.warning("No se pudo conectar a GCS para subir JSON")
-            except Exception as gcs_error:
-                logger.error(f"Error subiendo a GCS: {gcs_error}")
-                # Continuar sin fallar si GCS falla
-            
-            return filepath
+            # Subir a GCS sin bloquear la extracción del siguiente expense
+            gcs_path = f"raw/fact_expenses/{filename}"
+            self._pending_uploads.append(self._upload_pool.submit(self._upload_raw_to_gcs, payload, gcs_path))
+            
+            return str(filepath)
             
         except Exception as e:
             logger.error(f"Error guardando expense {expense_id}: {e}")
             raise
+    
+    def _upload_raw_to_gcs(self, payload: bytes, gcs_path: str):
+        """Sube el JSON crudo de un expense a GCS; los errores se registran sin propagarse."""
+        from utils.gcp import get_storage_client
+        from utils.env_config import config
+        
+        try:
+            client = get_storage_client()
+            if client:
+                bucket = client.bucket(config.GCS_BUCKET_NAME)
+                blob = bucket.blob(gcs_path)
+                blob.upload_from_string(payload, content_type='application/json')
+                
+                logger.info(f"🌩️  Subido JSON a GCS: {gcs_path}")
+            else:
+                logger.warning("No se pudo conectar a GCS para subir JSON")
+        except Exception as gcs_error:
+            logger.error(f"Error subiendo a GCS: {gcs_error}")
+            # Continuar sin fallar si GCS falla
+    
+    def wait_for_uploads(self):
+        """Espera a que terminen las subidas a GCS encoladas."""
+        if self._pending_uploads:
+            wait(self._pending_uploads)
+            self._pending_uploads = []
 
     def extract_range(self, start_id: int, end_id: int) -> Tuple[List[Dict], int]:
         """Extrae expenses en un rango específico de IDs, omitiendo los ya extraídos."""
@@ -326,26 +833,44 @@ class ExpenseExtractor:
             logger.info("🎯 Todos los IDs en el rango ya fueron extraídos")
             return [], 0
         
+        # Recortar la cola de IDs inexistentes entre los pendientes, antes del escaneo denso
+        max_id = self._clamp_end_id(unextracted_ids[0], unextracted_ids[-1])
+        if max_id < unextracted_ids[-1]:
+            unextracted_ids = [expense_id for expense_id in unextracted_ids if expense_id <= max_id]
+        
         expenses = []
         successful_count = 0
         
-        for expense_id in unextracted_ids:
-            try:
-                expense_data = self.get_expense_by_id(expense_id)
-                
-                if expense_data:
-                    expenses.append(expense_data)
-                    self.save_individual_expense(expense_data, expense_id)
-                    # Registrar en el log después de extracción exitosa
-                    self.log_extracted_id(expense_id)
-                    successful_count += 1
-                
-                # Pequeña pausa para no sobrecargar la API
-                time.sleep(0.1)
+        # Obtener el token antes de lanzar los hilos para no autenticar en paralelo
+        self._ensure_token()
+        
+        # Las descargas se hacen en paralelo; guardado y log se hacen en este hilo
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                # Grupos de IDs para pedir en bloque; de a uno si la API no admite el filtro por ID
+                group_size = BULK_FETCH_SIZE if self._bulk_supported else 1
+                groups = [unextracted_ids[i:i + group_size] for i in range(0, len(unextracted_ids), group_size)]
+                futures = {executor.submit(self._fetch_ids, group): group for group in groups}
                 
-            except Exception as e:
-                logger.error(f"Error procesando ID {expense_id}: {e}")
-                continue
+                for future in as_completed(futures):
+                    group = futures[future]
+                    try:
+                        for expense_id, content in future.result():
+                            # Se guardan los bytes recibidos y se parsean una sola vez para el procesamiento
+                            self.save_individual_expense(content, expense_id)
+                            expenses.append(orjson.loads(content))
+                            # Registrar en el log después de extracción exitosa
+                            self.log_extracted_id(expense_id)
+                            successful_count += 1
+                        
+                    except Exception as e:
+                        logger.error(f"Error procesando IDs {group[0]}-{group[-1]}: {e}")
+                        continue
+        finally:
+            # Los JSON del lote quedan en GCS antes de dar el lote por terminado
+            self.wait_for_uploads()
+            # Una sola subida del log por lote (más las intermedias cada LOG_FLUSH_EVERY IDs)
+            self.flush_log()
         
         logger.info(f"Extracción completada. Total expenses extraídos: {successful_count}")
         return expenses, successful_count
@@ -354,13 +879,12 @@ class ExpenseExtractor:
 def main():
     """Función principal."""
     try:
-        extractor = ExpenseExtractor()
-        
-        # Ejemplo: extraer primeros 10 expenses
-        start_id = 1
-        end_id = 10
-        
-        expenses, count = extractor.extract_range(start_id, end_id)
+        with ExpenseExtractor() as extractor:
+            # Ejemplo: extraer primeros 10 expenses
+            start_id = 1
+            end_id = 10
+            
+            expenses, count = extractor.extract_range(start_id, end_id)
         
         print(f"✅ Extracción completada")
         print(f"📊 Expenses extraídos: {count}")
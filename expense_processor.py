@@ -3,15 +3,54 @@
 Procesador simplificado de expenses - JSON a CSV particionado.
 """
 
-import json
+import orjson
 import os
+import re
 import pandas as pd
-from datetime import datetime
 import pytz
+from concurrent.futures import ProcessPoolExecutor
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Con menos archivos que esto no compensa arrancar procesos
+PARALLEL_MIN_FILES = 200
+PROCESS_CHUNKSIZE = 32
+RAW_FILE_PATTERN = re.compile(r"^expense_(\d+)\.json$")
+# Códec de las particiones: ZSTD comprime más que snappy (el default) y pyarrow/BigQuery lo leen sin cambios
+PARQUET_COMPRESSION = "zstd"
+
+# Relaciones del expense: (relación, tipo en included, columna de clave, columna de nombre)
+EXPENSE_RELATIONSHIPS = tuple(
+    (rel_name, rel_type, f"{rel_name.lower()}_key", f"{rel_name.lower()}_name")
+    for rel_name, rel_type in (
+        ('cashRegister', 'CashRegister'),
+        ('expenseCategory', 'ExpenseCategory'),
+        ('paymentMethod', 'PaymentMethod'),
+        ('provider', 'Provider'),
+        ('receiptType', 'ReceiptType'),
+        ('user', 'User')
+    )
+)
+
+# Esquema de fact_expense_orders para particiones sin items (mismo orden de columnas que _process_expense)
+EXPENSE_ORDER_DTYPES = {
+    'expense_order_key': 'object',
+    'expense_key': 'object',
+    'cancelled': 'bool',  # Forzar boolean para consistencia
+    'item_detail': 'object',
+    'item_price': 'float64',
+    'item_quantity': 'float64',
+    'product_key': 'object',
+    'product_name': 'object',
+    'product_cost': 'float64',
+    'product_unit': 'object',
+    'ingredient_key': 'object',
+    'ingredient_name': 'object',
+    'ingredient_cost': 'float64',
+    'ingredient_unit': 'object'
+}
+
 class ExpenseProcessor:
     """Procesador simplificado de expenses."""
     
@@ -24,27 +63,24 @@ class ExpenseProcessor:
     def _read_json(self, file_path):
         """Lee archivo JSON."""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(file_path, 'rb') as f:
+                return orjson.loads(f.read())
         except Exception as e:
             logger.error(f"Error leyendo {file_path}: {e}")
             return None
     
     def _extract_relationships(self, relationships, included, rel_name, rel_type):
-        """Extrae datos de relaciones."""
+        """Extrae el id y los atributos de una relación to-one."""
         rel_data = relationships.get(rel_name, {}).get('data', {})
         if not rel_data:
-            return {}
+            return 0, {}
         
         rel_id = rel_data.get('id')
         if not rel_id:
-            return {}
+            return 0, {}
         
-        key = f"{rel_type}_{rel_id}"
-        item_data = included.get(key, {})
-        attrs = item_data.get('attributes', {})
-        
-        return {f'{rel_name.lower()}_id': rel_id, **{f'{rel_name.lower()}_{k}': v for k, v in attrs.items()}}
+        item_data = included.get((rel_type, str(rel_id)), {})
+        return rel_id, item_data.get('attributes', {})
     
     def _process_expense(self, expense_data):
         """Procesa un expense y retorna datos principales e items."""
@@ -52,60 +88,34 @@ class ExpenseProcessor:
             data = expense_data.get('data', {})
             included_raw = expense_data.get('included', [])
             
-            # Organizar included por tipo_id - manteniendo estructura completa
-            included = {}
-            for item in included_raw:
-                key = f"{item.get('type', '')}_{item.get('id', '')}"
-                included[key] = {
-                    'attributes': item.get('attributes', {}),
-                    'relationships': item.get('relationships', {})
-                }
+            # Organizar included por (tipo, id) - se indexa el recurso completo, sin copiarlo
+            included = {(item.get('type', ''), str(item.get('id', ''))): item for item in included_raw}
             
             attrs = data.get('attributes', {})
             relationships = data.get('relationships', {})
             
-            # Convertir fecha a timezone local
-            created_at = attrs.get('createdAt', '')
-            if created_at:
-                try:
-                    dt = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                    local_dt = dt.astimezone(self.timezone)
-                    date_key = local_dt.strftime('%Y%m%d')
-                    time_key = local_dt.strftime('%H%M')
-                    date_str = local_dt.strftime('%Y-%m-%d')
-                except:
-                    date_key = time_key = date_str = ''
-            else:
-                date_key = time_key = date_str = ''
-            
-            # Expense principal
+            # Expense principal (las claves de fecha se calculan vectorizadas en _add_date_keys)
             expense = {
                 'expense_key': int(data.get('id', 0)),
                 'expense_amount': float(attrs.get('amount', 0.0)),
                 'cancelled': bool(attrs.get('canceled', False)),
-                'expense_date_key': date_key,
-                'payment_date_key': date_key,
+                'expense_date_key': '',
+                'payment_date_key': '',
                 'due_date_key': '',
-                'created_date_key': date_key,
-                'created_time_key': time_key,
+                'created_date_key': '',
+                'created_time_key': '',
                 'expense_note': str(attrs.get('description', '')),
                 'receipt_number': str(attrs.get('receiptNumber', '')),
                 'use_in_cash_count': bool(attrs.get('useInCashCount', False)),
-                'date': date_str
+                'date': '',
+                'created_at': attrs.get('createdAt', '')
             }
             
             # Agregar relaciones
-            for rel_name, rel_type in [
-                ('cashRegister', 'CashRegister'),
-                ('expenseCategory', 'ExpenseCategory'),
-                ('paymentMethod', 'PaymentMethod'),
-                ('provider', 'Provider'),
-                ('receiptType', 'ReceiptType'),
-                ('user', 'User')
-            ]:
-                rel_data = self._extract_relationships(relationships, included, rel_name, rel_type)
-                expense[f'{rel_name.lower()}_key'] = int(rel_data.get(f'{rel_name.lower()}_id', 0))
-                expense[f'{rel_name.lower()}_name'] = str(rel_data.get(f'{rel_name.lower()}_name', ''))
+            for rel_name, rel_type, key_column, name_column in EXPENSE_RELATIONSHIPS:
+                rel_id, rel_attrs = self._extract_relationships(relationships, included, rel_name, rel_type)
+                expense[key_column] = int(rel_id)
+                expense[name_column] = str(rel_attrs.get('name', ''))
             
             # Expense items
             items = []
@@ -116,7 +126,7 @@ class ExpenseProcessor:
                 if not item_id:
                     continue
                     
-                item_data = included.get(f"ExpenseItem_{item_id}", {})
+                item_data = included.get(('ExpenseItem', str(item_id)), {})
                 item_attrs = item_data.get('attributes', {})
                 item_relationships = item_data.get('relationships', {})
                 
@@ -141,7 +151,7 @@ class ExpenseProcessor:
                 product_ref = item_relationships.get('product', {}).get('data')
                 if product_ref and product_ref.get('id'):
                     product_id = product_ref.get('id')
-                    product_data = included.get(f"Product_{product_id}", {})
+                    product_data = included.get(('Product', str(product_id)), {})
                     product_attrs = product_data.get('attributes', {})
                     product_relationships = product_data.get('relationships', {})
                     
@@ -153,7 +163,7 @@ class ExpenseProcessor:
                     unit_ref = product_relationships.get('unit', {}).get('data')
                     if unit_ref and unit_ref.get('id'):
                         unit_id = unit_ref.get('id')
-                        unit_data = included.get(f"Unit_{unit_id}", {})
+                        unit_data = included.get(('Unit', str(unit_id)), {})
                         unit_attrs = unit_data.get('attributes', {})
                         item['product_unit'] = str(unit_attrs.get('name', ''))
                 
@@ -161,7 +171,7 @@ class ExpenseProcessor:
                 ingredient_ref = item_relationships.get('ingredient', {}).get('data')
                 if ingredient_ref and ingredient_ref.get('id'):
                     ingredient_id = ingredient_ref.get('id')
-                    ingredient_data = included.get(f"Ingredient_{ingredient_id}", {})
+                    ingredient_data = included.get(('Ingredient', str(ingredient_id)), {})
                     ingredient_attrs = ingredient_data.get('attributes', {})
                     ingredient_relationships = ingredient_data.get('relationships', {})
                     
@@ -173,7 +183,7 @@ class ExpenseProcessor:
                     unit_ref = ingredient_relationships.get('unit', {}).get('data')
                     if unit_ref and unit_ref.get('id'):
                         unit_id = unit_ref.get('id')
-                        unit_data = included.get(f"Unit_{unit_id}", {})
+                        unit_data = included.get(('Unit', str(unit_id)), {})
                         unit_attrs = unit_data.get('attributes', {})
                         item['ingredient_unit'] = str(unit_attrs.get('name', ''))
                 
@@ -185,12 +195,44 @@ class ExpenseProcessor:
             logger.error(f"Error procesando expense: {e}")
             return None, []
     
+    @staticmethod
+    def _to_columns(rows):
+        """Pasa una lista de filas (dicts con las mismas claves) a un dict de listas por columna."""
+        return {key: [row[key] for row in rows] for key in rows[0]}
+    
+    def _add_date_keys(self, expenses_df):
+        """Convierte createdAt a timezone local y completa las claves de fecha de toda la columna a la vez."""
+        created_at = pd.to_datetime(expenses_df.pop('created_at'), utc=True, errors='coerce', format='ISO8601')
+        local_dt = created_at.dt.tz_convert(self.timezone)
+        valid = local_dt.notna()
+        
+        # Claves calculadas con aritmética entera en vez de strftime elemento a elemento
+        date_num = local_dt.dt.year * 10000 + local_dt.dt.month * 100 + local_dt.dt.day
+        time_num = local_dt.dt.hour * 100 + local_dt.dt.minute
+        date_key = date_num.fillna(0).astype('int64').astype(str).where(valid, '')
+        
+        expenses_df['expense_date_key'] = date_key
+        expenses_df['payment_date_key'] = date_key
+        expenses_df['created_date_key'] = date_key
+        expenses_df['created_time_key'] = time_num.fillna(0).astype('int64').astype(str).str.zfill(4).where(valid, '')
+        
+        # datetime64[D] -> str da 'YYYY-MM-DD' directamente desde numpy
+        local_days = local_dt.dt.tz_localize(None).to_numpy().astype('datetime64[D]').astype(str)
+        expenses_df['date'] = pd.Series(local_days, index=expenses_df.index).where(valid, '')
+        return expenses_df
+    
     def _save_to_parquet(self, expenses_df, items_df):
         """Guarda los DataFrames en archivos Parquet particionados por fecha y los sube a GCS."""
         from utils.gcp import upload_parquet_to_gcs
         from utils.env_config import config
         
-        unique_dates = sorted(expenses_df['date'].unique())
+        # Particionar en una sola pasada: expenses por fecha e items por la fecha de su expense
+        expenses_by_date = dict(tuple(expenses_df.groupby('date', sort=True)))
+        unique_dates = list(expenses_by_date)
+        items_by_date = {}
+        if not items_df.empty:
+            id_to_date = dict(zip(expenses_df['expense_key'], expenses_df['date']))
+            items_by_date = dict(tuple(items_df.groupby(items_df['expense_key'].map(id_to_date), sort=False)))
         files_created = 0
         files_updated = 0
         
@@ -209,10 +251,9 @@ class ExpenseProcessor:
                 gcs_expenses_path = f"clean/fact_expenses/date={date_str}/fact_expenses.parquet"
                 gcs_items_path = f"clean/fact_expense_orders/date={date_str}/fact_expense_orders.parquet"
                 
-                # Filtrar datos por fecha
-                date_expenses = expenses_df[expenses_df['date'] == date_str].copy()
-                expense_ids = date_expenses['expense_key'].tolist()
-                date_items = items_df[items_df['expense_key'].isin(expense_ids)].copy() if not items_df.empty else pd.DataFrame()
+                # Datos de la fecha
+                date_expenses = expenses_by_date[date_str]
+                date_items = items_by_date.get(date_str, pd.DataFrame())
                 
                 # Limpiar columna 'date' antes de guardar
                 date_expenses = date_expenses.drop(columns=['date'])
@@ -230,13 +271,14 @@ class ExpenseProcessor:
                     combined = date_expenses
                 
                 # Guardar localmente
-                combined.to_parquet(expenses_file, index=False, engine='pyarrow')
+                combined.to_parquet(expenses_file, index=False, engine='pyarrow', compression=PARQUET_COMPRESSION)
                 
                 # Subir a GCS
                 upload_success = upload_parquet_to_gcs(
                     combined, 
                     config.GCS_BUCKET_NAME, 
-                    gcs_expenses_path
+                    gcs_expenses_path,
+                    compression=PARQUET_COMPRESSION
                 )
                 if upload_success:
                     logger.info(f"🌩️  Subido expenses a GCS: {gcs_expenses_path}")
@@ -251,38 +293,17 @@ class ExpenseProcessor:
                         combined_items = date_items
                 else:
                     # Crear archivo vacío con headers y datatypes específicos
-                    combined_items = pd.DataFrame(columns=[
-                        'expense_order_key', 'expense_key', 'cancelled', 'item_detail', 'item_price',
-                        'item_quantity', 'product_key', 'product_name', 'product_cost', 'product_unit',
-                        'ingredient_key', 'ingredient_name', 'ingredient_cost', 'ingredient_unit'
-                    ])
-                    
-                    # Forzar datatypes específicos para archivos vacíos
-                    combined_items = combined_items.astype({
-                        'expense_order_key': 'object',
-                        'expense_key': 'object', 
-                        'cancelled': 'bool',  # Forzar boolean para consistencia
-                        'item_detail': 'object',
-                        'item_price': 'float64',
-                        'item_quantity': 'float64',
-                        'product_key': 'object',
-                        'product_name': 'object',
-                        'product_cost': 'float64',
-                        'product_unit': 'object',
-                        'ingredient_key': 'object',
-                        'ingredient_name': 'object', 
-                        'ingredient_cost': 'float64',
-                        'ingredient_unit': 'object'
-                    })
+                    combined_items = pd.DataFrame(columns=list(EXPENSE_ORDER_DTYPES)).astype(EXPENSE_ORDER_DTYPES)
                 
                 # Guardar items localmente
-                combined_items.to_parquet(items_file, index=False, engine='pyarrow')
+                combined_items.to_parquet(items_file, index=False, engine='pyarrow', compression=PARQUET_COMPRESSION)
                 
                 # Subir items a GCS
                 upload_success_items = upload_parquet_to_gcs(
                     combined_items, 
                     config.GCS_BUCKET_NAME, 
-                    gcs_items_path
+                    gcs_items_path,
+                    compression=PARQUET_COMPRESSION
                 )
                 if upload_success_items:
                     logger.info(f"🌩️  Subido expense_orders a GCS: {gcs_items_path}")
@@ -300,27 +321,52 @@ class ExpenseProcessor:
                 continue
         
         logger.info(f"✅ Procesamiento completado: {files_created} fechas nuevas, {files_updated} actualizadas")
-        return {"dates_processed": list(unique_dates), "files_created": files_created, "files_updated": files_updated}
+        return {"dates_processed": unique_dates, "files_created": files_created, "files_updated": files_updated}
+
+    def _process_file(self, file_path):
+        """Lee y procesa un JSON de raw/ (se ejecuta en los procesos del pool)."""
+        expense_data = self._read_json(file_path)
+        if not expense_data:
+            return None, []
+        return self._process_expense(expense_data)
 
     def process_range(self, start_id, end_id):
-        """Procesa un rango de IDs."""
-        logger.info(f"🔄 INICIANDO PROCESAMIENTO DE RANGO {start_id}-{end_id}")
+        """Procesa un rango de IDs leyendo los JSON de raw/."""
+        # Un solo listado del directorio en vez de un stat por cada ID candidato
+        present_ids = set()
+        if os.path.isdir(self.raw_dir):
+            with os.scandir(self.raw_dir) as entries:
+                present_ids = {int(m.group(1)) for entry in entries if (m := RAW_FILE_PATTERN.match(entry.name))}
+        
+        file_paths = [
+            os.path.join(self.raw_dir, f"expense_{expense_id}.json")
+            for expense_id in sorted(present_ids)
+            if start_id <= expense_id <= end_id
+        ]
+        
+        # Cada archivo es independiente: parseo y aplanado en paralelo en todos los núcleos
+        if len(file_paths) >= PARALLEL_MIN_FILES:
+            with ProcessPoolExecutor() as executor:
+                processed = list(executor.map(self._process_file, file_paths, chunksize=PROCESS_CHUNKSIZE))
+        else:
+            processed = [self._process_file(file_path) for file_path in file_paths]
+        
+        return self._save_processed(processed, f"{start_id}-{end_id}")
+    
+    def process_expenses(self, expense_data_list, label=""):
+        """Procesa expenses ya cargados en memoria (p. ej. recién extraídos de la API)."""
+        processed = [self._process_expense(expense_data) for expense_data in expense_data_list]
+        return self._save_processed(processed, label)
+    
+    def _save_processed(self, processed, label):
+        """Arma los DataFrames a partir de los pares (expense, items) y los guarda en Parquet."""
+        logger.info(f"🔄 INICIANDO PROCESAMIENTO DE RANGO {label}")
         logger.info("="*50)
         
         expenses_list = []
         items_list = []
         
-        for expense_id in range(start_id, end_id + 1):
-            file_path = os.path.join(self.raw_dir, f"expense_{expense_id}.json")
-            
-            if not os.path.exists(file_path):
-                continue
-                
-            expense_data = self._read_json(file_path)
-            if not expense_data:
-                continue
-            
-            expense, items = self._process_expense(expense_data)
+        for expense, items in processed:
             if expense:
                 expenses_list.append(expense)
                 items_list.extend(items)
@@ -329,11 +375,11 @@ class ExpenseProcessor:
             logger.warning("No se encontraron expenses para procesar")
             return {"files_created": 0, "files_updated": 0}
         
-        # Crear DataFrames
-        expenses_df = pd.DataFrame(expenses_list)
-        items_df = pd.DataFrame(items_list) if items_list else pd.DataFrame()
+        # Crear DataFrames por columnas (todas las filas comparten las mismas claves)
+        expenses_df = self._add_date_keys(pd.DataFrame(self._to_columns(expenses_list), copy=False))
+        items_df = pd.DataFrame(self._to_columns(items_list), copy=False) if items_list else pd.DataFrame()
         
-        logger.info(f"Procesando rango de IDs: {start_id} - {end_id}")
+        logger.info(f"Procesando rango de IDs: {label}")
         logger.info(f"Rango procesado: {len(expenses_list)} archivos")
         logger.info(f"Total expenses: {len(expenses_list)}")
         logger.info(f"Total expense items: {len(items_list)}")
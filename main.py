@@ -8,7 +8,7 @@ import sys
 import argparse
 import time
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from expense_extractor import ExpenseExtractor
 from expense_processor import ExpenseProcessor
 from utils.logger import get_logger
@@ -22,6 +22,10 @@ class ExpenseOrchestrator:
         self.extractor = ExpenseExtractor()
         self.processor = ExpenseProcessor()
     
+    def close(self):
+        """Libera los recursos del extractor (conexiones HTTP)."""
+        self.extractor.close()
+    
     def get_next_ids_to_process(self, batch_size: int = 10) -> Tuple[int, int]:
         """
         Determina el próximo rango de IDs a procesar basado en el log de extraídos.
@@ -46,7 +50,7 @@ class ExpenseOrchestrator:
         logger.info(f"Próximo rango a procesar: {start_id} - {end_id}")
         return start_id, end_id
     
-    def extract_batch(self, start_id: int, end_id: int) -> Tuple[bool, int]:
+    def extract_batch(self, start_id: int, end_id: int) -> Tuple[bool, List[Dict]]:
         """
         Extrae un lote de expenses desde la API.
         
@@ -55,7 +59,7 @@ class ExpenseOrchestrator:
             end_id: ID final del rango
             
         Returns:
-            Tuple con (éxito, cantidad_extraída)
+            Tuple con (éxito, expenses_extraídos)
         """
         try:
             logger.info(f"🔄 INICIANDO EXTRACCIÓN DE LOTE {start_id}-{end_id}")
@@ -73,20 +77,21 @@ class ExpenseOrchestrator:
             print(f"📁 Archivos guardados en raw/")
             
             logger.info(f"✅ Extracción completada: {count} expenses extraídos")
-            return True, count
+            return True, expenses
             
         except Exception as e:
             logger.error(f"❌ Error en extracción del lote {start_id}-{end_id}: {e}")
             print(f"❌ Error en extracción: {e}")
-            return False, 0
+            return False, []
     
-    def process_batch(self, start_id: int, end_id: int) -> bool:
+    def process_batch(self, start_id: int, end_id: int, expenses: Optional[List[Dict]] = None) -> bool:
         """
         Procesa un lote de expenses a formato Parquet.
         
         Args:
             start_id: ID inicial del rango
             end_id: ID final del rango
+            expenses: Expenses ya extraídos en memoria; si es None se leen desde raw/
             
         Returns:
             True si el procesamiento fue exitoso
@@ -96,8 +101,11 @@ class ExpenseOrchestrator:
             print(f"🔄 PROCESANDO EXPENSES {start_id}-{end_id}")
             print("="*60)
             
-            # Procesar rango
-            result = self.processor.process_range(start_id, end_id)
+            # Procesar rango (en memoria si vienen de la extracción, si no desde raw/)
+            if expenses is not None:
+                result = self.processor.process_expenses(expenses, f"{start_id}-{end_id}")
+            else:
+                result = self.processor.process_range(start_id, end_id)
             
             print(f"✅ PROCESAMIENTO COMPLETADO")
             print(f"📊 Archivos creados: {result['files_created']}")
@@ -127,20 +135,18 @@ class ExpenseOrchestrator:
         print("="*80)
         
         # Paso 1: Extracción
-        success, count = self.extract_batch(start_id, end_id)
+        success, expenses = self.extract_batch(start_id, end_id)
         if not success:
             return False
         
+        count = len(expenses)
         if count == 0:
             print("⏭️  No hay nuevos expenses para procesar")
             logger.info("No hay nuevos expenses para procesar")
             return True
         
-        # Pequeña pausa entre procesos
-        time.sleep(1)
-        
-        # Paso 2: Procesamiento
-        success = self.process_batch(start_id, end_id)
+        # Paso 2: Procesamiento directo desde memoria, sin releer los JSON de raw/
+        success = self.process_batch(start_id, end_id, expenses)
         if not success:
             return False
         
@@ -287,7 +293,7 @@ def main():
             if not validate_id_range(args.start_id, args.end_id):
                 sys.exit(1)
             
-            success, count = orchestrator.extract_batch(args.start_id, args.end_id)
+            success, _ = orchestrator.extract_batch(args.start_id, args.end_id)
             sys.exit(0 if success else 1)
         
         elif args.command == 'process':
@@ -305,6 +311,8 @@ def main():
         logger.error(f"Error inesperado en main: {e}")
         print(f"❌ Error inesperado: {e}")
         sys.exit(1)
+    finally:
+        orchestrator.close()
 
 
 if __name__ == "__main__":
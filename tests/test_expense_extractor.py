@@ -0,0 +1,278 @@
+"""
+Pruebas del extractor contra una sesión HTTP falsa.
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import orjson
+
+import expense_extractor
+from expense_extractor import ExpenseExtractor
+
+
+def expense_document(expense_id):
+    """Documento {data, included} como lo retorna la consulta por ID."""
+    user_id = str(1000 + expense_id)
+    return {
+        "data": {
+            "type": "Expense",
+            "id": str(expense_id),
+            "attributes": {"amount": expense_id, "description": f"gasto {expense_id}"},
+            "relationships": {"user": {"data": {"type": "User", "id": user_id}}}
+        },
+        "included": [{"type": "User", "id": user_id, "attributes": {"name": f"usuario {user_id}"}}]
+    }
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeSession:
+    """
+    Sesión falsa de la API de Fudo.
+
+    bulk_mode: "honest" responde el filtro por ID, "empty" siempre {"data": []}
+    y "hide" omite de la lista los IDs de hidden_in_list (pero existen por ID).
+    forced_response: si se indica, se devuelve para toda petición (p. ej. un 429).
+    """
+
+    def __init__(self, existing, bulk_mode="honest", hidden_in_list=(), forced_response=None):
+        self.existing = set(existing)
+        self.bulk_mode = bulk_mode
+        self.hidden_in_list = set(hidden_in_list)
+        self.forced_response = forced_response
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, params=None, timeout=None):
+        with self._lock:
+            self.calls.append((method, url))
+        if self.forced_response is not None:
+            return self.forced_response
+        parts = urlsplit(url)
+        tail = parts.path.rsplit("/", 1)[-1]
+
+        if tail == "expenses":
+            return self._bulk(parse_qs(parts.query))
+        expense_id = int(tail)
+        if expense_id not in self.existing:
+            return FakeResponse(404)
+        if method == "HEAD":
+            return FakeResponse(200)
+        return FakeResponse(200, orjson.dumps(expense_document(expense_id)))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def _bulk(self, query):
+        if self.bulk_mode == "empty":
+            return FakeResponse(200, b'{"data":[]}')
+        requested = [int(i) for i in query["filter[id]"][0].split(",")]
+        found = [i for i in requested if i in self.existing and i not in self.hidden_in_list]
+        documents = [expense_document(i) for i in found]
+        body = {
+            "data": [doc["data"] for doc in documents],
+            "included": [item for doc in documents for item in doc["included"]],
+            "links": {"next": None}
+        }
+        return FakeResponse(200, orjson.dumps(body, option=orjson.OPT_INDENT_2))
+
+    def close(self):
+        pass
+
+
+class ExtractorTestCase(unittest.TestCase):
+    """Crea el extractor en un directorio temporal, sin GCS ni autenticación real."""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        self.addCleanup(self._restore_cwd)
+
+        for name in ("_download_log_from_gcs", "_upload_raw_to_gcs", "_upload_log_to_gcs"):
+            patcher = mock.patch.object(ExpenseExtractor, name, return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(ExpenseExtractor, "_sync_log_from_gcs", return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.extractor = ExpenseExtractor()
+        self.addCleanup(self.extractor.close)
+        self.extractor._set_token("token-de-prueba", time.time() + 3600)
+
+    def _restore_cwd(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def use_session(self, session):
+        self.extractor.session = session
+        return session
+
+
+class BulkFetchTest(ExtractorTestCase):
+
+    def test_respuesta_en_bloque_vacia_recurre_a_pedidos_por_id(self):
+        self.use_session(FakeSession(range(1, 11), bulk_mode="empty"))
+        results = dict(self.extractor._fetch_ids(list(range(1, 11))))
+        self.assertEqual(sorted(results), list(range(1, 11)))
+        self.assertFalse(self.extractor._bulk_supported)
+
+    def test_ids_ocultos_en_la_lista_se_piden_de_a_uno(self):
+        session = self.use_session(FakeSession(range(1, 11), hidden_in_list={4, 7}))
+        results = dict(self.extractor._fetch_ids(list(range(1, 11))))
+        self.assertEqual(sorted(results), list(range(1, 11)))
+        self.assertFalse(self.extractor._bulk_supported)
+        single = [url for method, url in session.calls if "/expenses/" in url]
+        self.assertEqual(len(single), 2)
+
+    def test_ids_inexistentes_no_desactivan_el_bloque(self):
+        self.use_session(FakeSession({1, 2, 3, 5}))
+        results = dict(self.extractor._fetch_ids([1, 2, 3, 4, 5]))
+        self.assertEqual(sorted(results), [1, 2, 3, 5])
+        self.assertTrue(self.extractor._bulk_supported)
+
+    def test_filtro_por_id_como_lista_separada_por_comas(self):
+        session = self.use_session(FakeSession({1, 2, 3}))
+        self.extractor._fetch_expenses_bulk([1, 2, 3])
+        query = parse_qs(urlsplit(session.calls[0][1]).query)
+        self.assertEqual(query["filter[id]"], ["1,2,3"])
+
+    def test_division_arma_documentos_compactos_como_la_consulta_por_id(self):
+        session = self.use_session(FakeSession({1, 2}))
+        content = session._bulk({"filter[id]": ["1,2"]}).content
+        documents = ExpenseExtractor._split_bulk_response(content)
+
+        self.assertEqual(sorted(documents), [1, 2])
+        for expense_id, document in documents.items():
+            self.assertEqual(orjson.loads(document), expense_document(expense_id))
+            # La respuesta viene indentada; el JSON crudo se guarda compacto
+            self.assertNotIn(b"\n", document)
+
+    def test_extract_range_con_bloque_vacio_extrae_todo(self):
+        self.use_session(FakeSession(range(1, 116), bulk_mode="empty"))
+        expenses, count = self.extractor.extract_range(1, 115)
+        self.assertEqual(count, 115)
+        self.assertEqual(len(list(Path("raw").glob("expense_*.json"))), 115)
+
+
+
+class ProbeClampTest(ExtractorTestCase):
+
+    def test_ids_borrados_al_inicio_del_rango(self):
+        self.use_session(FakeSession(range(54, 116)))
+        self.assertGreaterEqual(self.extractor._clamp_end_id(50, 200), 115)
+
+    def test_extract_range_con_ids_borrados_al_inicio(self):
+        self.use_session(FakeSession(range(54, 116)))
+        expenses, count = self.extractor.extract_range(50, 200)
+        self.assertEqual(count, 62)
+
+    def test_hueco_en_el_punto_medio_de_la_busqueda_binaria(self):
+        self.use_session(FakeSession(set(range(1, 400)) - {383, 384, 385}))
+        self.assertGreaterEqual(self.extractor._clamp_end_id(1, 1000), 399)
+
+    def test_hueco_de_veinte_ids_no_recorta_el_rango(self):
+        self.use_session(FakeSession(set(range(1, 501)) - set(range(250, 270))))
+        self.assertGreaterEqual(self.extractor._clamp_end_id(1, 1000), 500)
+
+    def test_expenses_al_final_del_rango_tras_un_hueco_largo(self):
+        self.use_session(FakeSession(set(range(1, 101)) | set(range(990, 1001))))
+        self.assertEqual(self.extractor._clamp_end_id(1, 1000), 1000)
+
+    def test_sin_expenses_confirmados_se_escanea_completo(self):
+        self.use_session(FakeSession(set()))
+        self.assertEqual(self.extractor._clamp_end_id(1, 200), 200)
+
+    def test_cola_vacia_se_recorta(self):
+        self.use_session(FakeSession(range(1, 501)))
+        max_id = self.extractor._clamp_end_id(1, 10000)
+        self.assertGreaterEqual(max_id, 500)
+        self.assertLess(max_id, 600)
+
+    def test_rango_ya_extraido_no_sondea(self):
+        session = self.use_session(FakeSession(range(1, 301)))
+        self.extractor._extracted_ids = set(range(1, 301))
+        expenses, count = self.extractor.extract_range(1, 300)
+        self.assertEqual(count, 0)
+        self.assertEqual(session.calls, [])
+
+
+class RateLimitTest(ExtractorTestCase):
+
+    def test_sesion_devuelve_el_ultimo_429_en_vez_de_lanzar(self):
+        session = ExpenseExtractor._create_session()
+        self.addCleanup(session.close)
+        retry = session.get_adapter("https://api.fu.do").max_retries
+        self.assertIn(429, retry.status_forcelist)
+        self.assertFalse(retry.raise_on_status)
+
+    def test_429_con_retry_after_pausa_a_todos_los_hilos(self):
+        self.use_session(FakeSession(set(), forced_response=FakeResponse(429, headers={"Retry-After": "7"})))
+        with mock.patch.object(self.extractor.rate_limiter, "defer") as defer:
+            self.assertIsNone(self.extractor.get_expense_content_by_id(1))
+        defer.assert_called_once_with(7.0)
+
+    def test_cuota_casi_agotada_pausa_hasta_el_reinicio(self):
+        headers = {"X-RateLimit-Remaining": "1", "X-RateLimit-Limit": "100", "X-RateLimit-Reset": "12"}
+        self.use_session(FakeSession({1}, forced_response=FakeResponse(200, b'{"data":{}}', headers)))
+        with mock.patch.object(self.extractor.rate_limiter, "defer") as defer:
+            self.extractor.get_expense_content_by_id(1)
+        defer.assert_called_once_with(12.0)
+
+
+class TokenCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        patcher = mock.patch.object(expense_extractor, "TOKEN_CACHE_DIR", Path(self._tmp.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.extractor = ExpenseExtractor.__new__(ExpenseExtractor)
+
+    def test_token_de_otra_credencial_no_se_reutiliza(self):
+        key_a = ExpenseExtractor._token_cache_key("api-key-a")
+        key_b = ExpenseExtractor._token_cache_key("api-key-b")
+        self.extractor._save_cached_token(key_a, "token-a", time.time() + 3600)
+
+        self.assertFalse(self.extractor._load_cached_token(key_b))
+        self.assertTrue(self.extractor._load_cached_token(key_a))
+        self.assertEqual(self.extractor.token, "token-a")
+
+    def test_entrada_con_clave_distinta_se_rechaza(self):
+        key_a = ExpenseExtractor._token_cache_key("api-key-a")
+        path = ExpenseExtractor._token_cache_path(key_a)
+        path.write_bytes(orjson.dumps({"key": "otra", "token": "x", "expires_at": time.time() + 3600}))
+        self.assertFalse(self.extractor._load_cached_token(key_a))
+
+    def test_acierto_de_cache_no_lee_el_secreto(self):
+        key = ExpenseExtractor._token_cache_key("api-key-a")
+        self.extractor._save_cached_token(key, "token-a", time.time() + 3600)
+        secrets = {"fudo-api-key": "api-key-a", "fudo-api-secret": "secreto"}
+
+        with mock.patch.object(expense_extractor, "get_secret", side_effect=secrets.get) as get_secret:
+            self.assertEqual(self.extractor.get_token(use_cache=True), "token-a")
+        get_secret.assert_called_once_with("fudo-api-key")
+
+if __name__ == "__main__":
+    unittest.main()
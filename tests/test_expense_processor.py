@@ -0,0 +1,147 @@
+"""
+Pruebas del procesador: claves de fecha en timezone local y partición por fecha.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from expense_processor import ExpenseProcessor
+
+
+def expense_document(expense_id, created_at, item_ids=()):
+    """Documento {data, included} como lo guarda el extractor en raw/."""
+    return {
+        "data": {
+            "type": "Expense",
+            "id": str(expense_id),
+            "attributes": {"amount": 10.5, "canceled": False, "createdAt": created_at, "description": f"gasto {expense_id}"},
+            "relationships": {
+                "expenseItems": {"data": [{"type": "ExpenseItem", "id": str(i)} for i in item_ids]},
+                "user": {"data": {"type": "User", "id": "7"}}
+            }
+        },
+        "included": [{"type": "User", "id": "7", "attributes": {"name": "Ana"}}] + [
+            {"type": "ExpenseItem", "id": str(i), "attributes": {"detail": f"item {i}", "price": 2.0, "quantity": 3.0, "canceled": False}}
+            for i in item_ids
+        ]
+    }
+
+
+class ProcessorTestCase(unittest.TestCase):
+    """Crea el procesador en un directorio temporal."""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        self.addCleanup(self._restore_cwd)
+        self.processor = ExpenseProcessor()
+
+    def _restore_cwd(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+
+class AddDateKeysTest(ProcessorTestCase):
+    """createdAt se convierte a America/Bogota igual que la versión fila a fila."""
+
+    CASES = [
+        # (createdAt, expense_date_key, created_time_key, date)
+        ("2024-03-01T02:05:00Z", "20240229", "2105", "2024-02-29"),
+        ("2024-03-01T10:07:00.000-03:00", "20240301", "0807", "2024-03-01"),
+        ("2024-03-01T13:07:09.123456+00:00", "20240301", "0807", "2024-03-01"),
+        ("", "", "", ""),
+        (None, "", "", ""),
+        ("no-es-fecha", "", "", ""),
+    ]
+
+    def test_claves_de_fecha(self):
+        expenses_df = pd.DataFrame({
+            "expense_key": range(len(self.CASES)),
+            "expense_date_key": "",
+            "payment_date_key": "",
+            "due_date_key": "",
+            "created_date_key": "",
+            "created_time_key": "",
+            "date": "",
+            "created_at": [case[0] for case in self.CASES]
+        })
+        result = self.processor._add_date_keys(expenses_df)
+
+        self.assertNotIn("created_at", result.columns)
+        for row, (created_at, date_key, time_key, date_str) in zip(result.to_dict("records"), self.CASES):
+            with self.subTest(created_at=created_at):
+                self.assertEqual(row["expense_date_key"], date_key)
+                self.assertEqual(row["payment_date_key"], date_key)
+                self.assertEqual(row["created_date_key"], date_key)
+                self.assertEqual(row["created_time_key"], time_key)
+                self.assertEqual(row["date"], date_str)
+                self.assertEqual(row["due_date_key"], "")
+
+
+class PartitionTest(ProcessorTestCase):
+    """process_expenses parte expenses e items por la fecha local de cada expense."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("utils.gcp.upload_parquet_to_gcs", return_value=True)
+        self.upload = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _read(self, table, date_str):
+        return pd.read_parquet(os.path.join("clean", table, f"date={date_str}", f"{table}.parquet"))
+
+    def test_particion_por_fecha(self):
+        documents = [
+            expense_document(1, "2024-03-01T02:05:00Z", item_ids=[11, 12]),
+            expense_document(2, "2024-03-01T15:00:00Z", item_ids=[21]),
+            expense_document(3, "2024-03-01T16:30:00Z"),
+        ]
+        result = self.processor.process_expenses(documents, "1-3")
+
+        self.assertEqual(result["dates_processed"], ["2024-02-29", "2024-03-01"])
+        self.assertEqual(result["files_created"], 2)
+        self.assertEqual(result["files_updated"], 0)
+
+        expenses_0229 = self._read("fact_expenses", "2024-02-29")
+        expenses_0301 = self._read("fact_expenses", "2024-03-01")
+        self.assertEqual(expenses_0229["expense_key"].tolist(), [1])
+        self.assertEqual(expenses_0301["expense_key"].tolist(), [2, 3])
+        self.assertEqual(expenses_0301["created_time_key"].tolist(), ["1000", "1130"])
+        self.assertNotIn("date", expenses_0301.columns)
+        self.assertEqual(expenses_0229["user_name"].tolist(), ["Ana"])
+
+        items_0229 = self._read("fact_expense_orders", "2024-02-29")
+        items_0301 = self._read("fact_expense_orders", "2024-03-01")
+        self.assertEqual(items_0229["expense_order_key"].tolist(), [11, 12])
+        self.assertEqual(items_0301["expense_order_key"].tolist(), [21])
+        self.assertEqual(items_0301["expense_key"].tolist(), [2])
+
+        # Expenses y orders de cada fecha se suben a GCS
+        self.assertEqual(self.upload.call_count, 4)
+
+    def test_fecha_sin_items_genera_archivo_vacio_con_esquema(self):
+        self.processor.process_expenses([expense_document(3, "2024-03-01T16:30:00Z")], "3")
+        items = self._read("fact_expense_orders", "2024-03-01")
+        self.assertTrue(items.empty)
+        self.assertIn("expense_order_key", items.columns)
+        self.assertEqual(items["cancelled"].dtype, bool)
+
+    def test_reproceso_reemplaza_expenses_de_la_fecha(self):
+        self.processor.process_expenses([expense_document(2, "2024-03-01T15:00:00Z", item_ids=[21])], "2")
+        result = self.processor.process_expenses([
+            expense_document(2, "2024-03-01T15:00:00Z", item_ids=[22]),
+            expense_document(3, "2024-03-01T16:30:00Z"),
+        ], "2-3")
+
+        self.assertEqual(result["files_updated"], 1)
+        self.assertEqual(self._read("fact_expenses", "2024-03-01")["expense_key"].tolist(), [2, 3])
+        self.assertEqual(self._read("fact_expense_orders", "2024-03-01")["expense_order_key"].tolist(), [22])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Pruebas de RateLimiter y AdaptiveConcurrency.
+"""
+
+import time
+import unittest
+
+from utils.throttling import AdaptiveConcurrency, RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+    """Token bucket: ráfagas dentro del cupo, espera al agotarlo y pausas con defer()."""
+
+    def test_sin_limite_no_bloquea(self):
+        limiter = RateLimiter(0)
+        start = time.monotonic()
+        for _ in range(1000):
+            limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_rafaga_dentro_del_cupo_y_espera_al_agotarlo(self):
+        limiter = RateLimiter(20)
+        start = time.monotonic()
+        for _ in range(20):
+            limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.05)
+
+        # El token 21 llega recién tras recargar 1/20 s
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_defer_pausa_aunque_no_haya_limite(self):
+        limiter = RateLimiter(0)
+        limiter.defer(0.1)
+        start = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+    """AIMD: una reducción por RTT, subida con latencias bajas y circuito ante errores seguidos."""
+
+    def _acquire(self, controller, count):
+        for _ in range(count):
+            controller.acquire()
+
+    def test_rafaga_de_respuestas_lentas_reduce_una_sola_vez(self):
+        controller = AdaptiveConcurrency(max_limit=16, target_latency=0.01)
+        self._acquire(controller, 4)
+        # Las cuatro estaban en curso a la vez: solo la primera reduce el límite
+        for _ in range(4):
+            controller.release(1.0, success=True)
+        self.assertEqual(controller.limit, 8)
+
+    def test_respuesta_lenta_posterior_vuelve_a_reducir(self):
+        controller = AdaptiveConcurrency(max_limit=16, target_latency=0.01)
+        self._acquire(controller, 1)
+        controller.release(1.0, success=True)
+        self.assertEqual(controller.limit, 8)
+
+        # Petición iniciada después de la reducción: es un RTT nuevo
+        self._acquire(controller, 1)
+        time.sleep(0.05)
+        controller.release(0.02, success=True)
+        self.assertEqual(controller.limit, 4)
+
+    def test_errores_en_curso_reducen_una_vez_pero_cuentan_para_el_circuito(self):
+        controller = AdaptiveConcurrency(max_limit=16, failure_threshold=3, cooldown=60)
+        self._acquire(controller, 3)
+        for _ in range(3):
+            controller.release(1.0, success=False)
+        self.assertEqual(controller.limit, 8)
+        self.assertGreater(controller._open_until, time.monotonic())
+
+    def test_latencia_bajo_el_objetivo_sube_el_limite(self):
+        controller = AdaptiveConcurrency(max_limit=16, min_limit=1, target_latency=1.0, increase=0.5)
+        controller.limit = 4
+        self._acquire(controller, 1)
+        controller.release(0.1, success=True)
+        self.assertEqual(controller.limit, 4.5)
+
+    def test_objetivo_propio_por_peticion(self):
+        controller = AdaptiveConcurrency(max_limit=16, target_latency=0.01)
+        controller.limit = 4
+        self._acquire(controller, 1)
+        # Lenta para el objetivo general, pero dentro del objetivo de una petición en bloque
+        controller.release(0.5, success=True, target_latency=1.0)
+        self.assertEqual(controller.limit, 4.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
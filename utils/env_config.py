@@ -10,6 +10,8 @@ class Config:
     GCP_PROJECT_NAME = os.getenv("GCP_PROJECT_NAME")
     GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID") or os.getenv("GOOGLE_CLOUD_PROJECT")
     GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", os.getenv("GOOGLE_CREDENTIALS_PATH"))
+    # Máximo de peticiones por segundo a la API de Fudo (0 = sin límite)
+    EXPENSE_RPS = float(os.getenv("EXPENSE_RPS", "0"))
     
 config = Config()
 
@@ -8,6 +8,9 @@ logger = get_logger(__name__)
 
 # Cliente singleton
 _storage_client = None
+_secret_client = None
+# Secretos ya leídos en este proceso
+_secret_cache = {}
 
 def get_storage_client():
     """Inicializa (una vez) y devuelve el cliente de Google Cloud Storage."""
@@ -59,7 +62,7 @@ def upload_csv_to_gcs(dataframe: pd.DataFrame, bucket_name: str, gcs_file_path:
         return False
 
 
-def upload_parquet_to_gcs(dataframe: pd.DataFrame, bucket_name: str, gcs_file_path: str, content_type: str = 'application/octet-stream'):
+def upload_parquet_to_gcs(dataframe: pd.DataFrame, bucket_name: str, gcs_file_path: str, content_type: str = 'application/octet-stream', compression: str = 'snappy'):
     """
     Sube un DataFrame de pandas como Parquet a Google Cloud Storage.
 
@@ -68,6 +71,7 @@ def upload_parquet_to_gcs(dataframe: pd.DataFrame, bucket_name: str, gcs_file_pa
         bucket_name: Nombre del bucket de GCS.
         gcs_file_path: Ruta del archivo en GCS.
         content_type: Tipo de contenido del archivo.
+        compression: Códec de compresión del Parquet (snappy, zstd, gzip...).
 
     Returns:
         bool: True si se subió correctamente, False en caso contrario.
@@ -83,7 +87,7 @@ def upload_parquet_to_gcs(dataframe: pd.DataFrame, bucket_name: str, gcs_file_pa
         # Crear el archivo Parquet en memoria
         import io
         parquet_buffer = io.BytesIO()
-        dataframe.to_parquet(parquet_buffer, engine='pyarrow', index=False)
+        dataframe.to_parquet(parquet_buffer, engine='pyarrow', index=False, compression=compression)
         parquet_data = parquet_buffer.getvalue()
         
         blob.upload_from_string(parquet_data, content_type=content_type)
@@ -134,29 +138,47 @@ def download_file_from_gcs(bucket_name: str, gcs_file_path: str, local_file_path
         return False
 
 
+def get_secret_client():
+    """Inicializa (una vez) y devuelve el cliente de Secret Manager."""
+    global _secret_client
+    if _secret_client:
+        return _secret_client
+
+    if config.GOOGLE_APPLICATION_CREDENTIALS:
+        credentials = service_account.Credentials.from_service_account_file(config.GOOGLE_APPLICATION_CREDENTIALS)
+        _secret_client = secretmanager.SecretManagerServiceClient(credentials=credentials)
+        logger.info("Cliente de Secret Manager inicializado con archivo de credenciales.")
+    else:
+        _secret_client = secretmanager.SecretManagerServiceClient()
+        logger.info("Cliente de Secret Manager inicializado con Application Default Credentials (ADC).")
+
+    return _secret_client
+
+
 def get_secret(secret_id: str) -> str:
     """
     Recupera el valor de un secreto almacenado en Secret Manager.
 
+    El valor se guarda en memoria tras la primera lectura exitosa, de modo que
+    las renovaciones de token no vuelven a consultar Secret Manager.
+
     Args:
         secret_id: ID del secreto.
 
     Returns:
         Valor del secreto como string.
     """
+    if secret_id in _secret_cache:
+        return _secret_cache[secret_id]
+
     try:
-        if config.GOOGLE_APPLICATION_CREDENTIALS:
-            credentials = service_account.Credentials.from_service_account_file(config.GOOGLE_APPLICATION_CREDENTIALS)
-            client = secretmanager.SecretManagerServiceClient(credentials=credentials)
-            logger.info("Cliente de Secret Manager inicializado con archivo de credenciales.")
-        else:
-            client = secretmanager.SecretManagerServiceClient()
-            logger.info("Cliente de Secret Manager inicializado con Application Default Credentials (ADC).")
-        
+        client = get_secret_client()
         name = f"projects/{config.GCP_PROJECT_ID}/secrets/{secret_id}/versions/latest"
         response = client.access_secret_version(request={"name": name})
         logger.info(f"Secreto '{secret_id}' accedido correctamente.")
-        return response.payload.data.decode("UTF-8")
+        value = response.payload.data.decode("UTF-8")
+        _secret_cache[secret_id] = value
+        return value
     except Exception as e:
         logger.error(f"Error al acceder al secreto '{secret_id}': {e}")
         return ""
\ No newline at end of file
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import deque
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket compartido entre hilos: admite ráfagas de hasta `burst` peticiones
+    y un promedio de `max_rps` por segundo. Con max_rps=0 no limita, pero sigue
+    respetando las pausas pedidas con defer().
+    """
+
+    def __init__(self, max_rps: float, burst: float = 0):
+        self._rate = max_rps if max_rps > 0 else 0.0
+        self._capacity = float(burst) if burst > 0 else max(1.0, self._rate)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea solo el tiempo necesario para no superar el ritmo configurado."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait_time = self._paused_until - now
+                if wait_time <= 0:
+                    if not self._rate:
+                        return
+                    # Recargar los tokens acumulados desde la última petición
+                    self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait_time = (1 - self._tokens) / self._rate
+            time.sleep(wait_time)
+
+    def defer(self, seconds: float):
+        """Retrasa el próximo envío al menos `seconds` segundos (p. ej. hasta que la API reinicie su cuota)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AdaptiveConcurrency:
+    """
+    Controla cuántas peticiones pueden estar en curso a la vez (AIMD).
+
+    El límite sube de a `increase` mientras la latencia media de la ventana se
+    mantiene bajo `target_latency`, y se reduce a la mitad si la supera o ante
+    un error (429/5xx/fallo de conexión). Como en AIMD clásico se reduce a lo
+    sumo una vez por RTT: las respuestas de peticiones que ya estaban en curso
+    en la última reducción no vuelven a reducir. Tras `failure_threshold`
+    errores seguidos el circuito se abre y nadie envía durante `cooldown` segundos.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, target_latency: float = 1.5,
+                 increase: float = 0.5, window: int = 20, failure_threshold: int = 5,
+                 cooldown: float = 30.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.target_latency = target_latency
+        self.increase = increase
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._latencies = deque(maxlen=window)
+        self._in_flight = 0
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._last_decrease = float("-inf")
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Espera hasta que haya cupo y el circuito esté cerrado."""
+        with self._cond:
+            while True:
+                remaining = self._open_until - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                elif self._in_flight < int(self.limit):
+                    break
+                else:
+                    self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, latency: float, success: bool, target_latency: float = None):
+        """
+        Libera el cupo y ajusta el límite según el resultado de la petición.
+        
+        target_latency permite evaluar peticiones más pesadas (p. ej. en bloque)
+        contra su propio objetivo; por defecto se usa el del controlador.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            # Una petición iniciada antes de la última reducción ya no informa sobre el límite actual
+            stale = time.monotonic() - latency < self._last_decrease
+            if success:
+                self._consecutive_failures = 0
+                if not stale:
+                    # La ventana guarda la latencia relativa al objetivo de cada petición
+                    self._latencies.append(latency / (target_latency or self.target_latency))
+                    if sum(self._latencies) / len(self._latencies) <= 1:
+                        self.limit = min(self.max_limit, self.limit + self.increase)
+                    else:
+                        self._decrease()
+            else:
+                self._consecutive_failures += 1
+                if not stale:
+                    self._decrease()
+                if self._consecutive_failures >= self.failure_threshold:
+                    self._open_until = time.monotonic() + self.cooldown
+                    logger.warning(f"⛔ {self._consecutive_failures} errores seguidos de la API, pausando {self.cooldown:.0f}s")
+            self._cond.notify_all()
+
+    def _decrease(self):
+        """Reduce el límite a la mitad y descarta la ventana para no volver a reducir por las mismas muestras."""
+        self.limit = max(self.min_limit, self.limit / 2)
+        self._latencies.clear()
+        self._last_decrease = time.monotonic()